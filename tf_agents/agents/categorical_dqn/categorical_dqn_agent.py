@@ -36,7 +36,6 @@ from tf_agents.policies import boltzmann_policy
 from tf_agents.policies import categorical_q_policy
 from tf_agents.policies import epsilon_greedy_policy
 from tf_agents.policies import greedy_policy
-from tf_agents.trajectories import trajectory
 from tf_agents.utils import common
 from tf_agents.utils import nest_utils
 from tf_agents.utils import value_ops
@@ -67,6 +66,7 @@ class CategoricalDqnAgent(dqn_agent.DqnAgent):
                reward_scale_factor=1.0,
                gradient_clipping=None,
                # Params for debugging
+               check_numerics=False,
                debug_summaries=False,
                summarize_grads_and_vars=False,
                train_step_counter=None,
@@ -151,6 +151,8 @@ class CategoricalDqnAgent(dqn_agent.DqnAgent):
       gamma: A discount factor for future rewards.
       reward_scale_factor: Multiplicative scale for the reward.
       gradient_clipping: Norm length to clip gradients.
+      check_numerics: If true, adds `tf.debugging.check_numerics` to help find
+        NaN / Inf values in the loss. For debugging only.
       debug_summaries: A bool to gather debug summaries.
       summarize_grads_and_vars: If True, gradient and network variable summaries
         will be written during training.
@@ -179,6 +181,7 @@ class CategoricalDqnAgent(dqn_agent.DqnAgent):
         gamma=gamma,
         reward_scale_factor=reward_scale_factor,
         gradient_clipping=gradient_clipping,
+        check_numerics=check_numerics,
         debug_summaries=debug_summaries,
         summarize_grads_and_vars=summarize_grads_and_vars,
         train_step_counter=train_step_counter,
@@ -269,24 +272,9 @@ class CategoricalDqnAgent(dqn_agent.DqnAgent):
     # method requires a time dimension to compute the loss properly.
     self._check_trajectory_dimensions(experience)
 
-    squeeze_time_dim = not self._q_network.state_spec
-    if self._n_step_update == 1:
-      time_steps, policy_steps, next_time_steps = (
-          trajectory.experience_to_transitions(experience, squeeze_time_dim))
-      actions = policy_steps.action
-    else:
-      # To compute n-step returns, we need the first time steps, the first
-      # actions, and the last time steps. Therefore we extract the first and
-      # last transitions from our Trajectory.
-      first_two_steps = tf.nest.map_structure(lambda x: x[:, :2], experience)
-      last_two_steps = tf.nest.map_structure(lambda x: x[:, -2:], experience)
-      time_steps, policy_steps, _ = (
-          trajectory.experience_to_transitions(
-              first_two_steps, squeeze_time_dim))
-      actions = policy_steps.action
-      _, _, next_time_steps = (
-          trajectory.experience_to_transitions(
-              last_two_steps, squeeze_time_dim))
+    time_steps, policy_steps, next_time_steps = (
+        self._experience_to_transitions(experience))
+    actions = policy_steps.action
 
     with tf.name_scope('critic_loss'):
       tf.nest.assert_same_structure(actions, self.action_spec)
@@ -29,16 +29,19 @@ from __future__ import print_function
 import collections
 
 import gin
+import numpy as np
 import tensorflow as tf  # pylint: disable=g-explicit-tensorflow-version-import
 from tf_agents.agents import tf_agent
 from tf_agents.policies import boltzmann_policy
 from tf_agents.policies import epsilon_greedy_policy
 from tf_agents.policies import greedy_policy
 from tf_agents.policies import q_policy
+from tf_agents.trajectories import policy_step
+from tf_agents.trajectories import time_step as ts
 from tf_agents.trajectories import trajectory
 from tf_agents.utils import common
+from tf_agents.utils import composite
 from tf_agents.utils import eager_utils
-from tf_agents.utils import nest_utils
 from tf_agents.utils import training as training_lib
 from tf_agents.utils import value_ops
 
@@ -66,8 +69,95 @@ class DqnLossInfo(collections.namedtuple('DqnLossInfo',
   pass
 
 
-def compute_td_targets(next_q_values, rewards, discounts):
-  return tf.stop_gradient(rewards + discounts * next_q_values)
+def compute_td_targets(next_q_values, rewards, discounts, gamma=1.0,
+                       reward_scale_factor=1.0):
+  """Computes the one step TD targets.
+
+  Args:
+    next_q_values: A float tensor of Q values for the next time steps.
+    rewards: A float tensor of rewards, shaped like `next_q_values`.
+    discounts: A float tensor of discounts, shaped like `next_q_values`.
+    gamma: Discount for future rewards.
+    reward_scale_factor: Multiplicative factor to scale rewards.
+
+  Returns:
+    A tensor of TD targets, with gradients stopped.
+  """
+  return tf.stop_gradient(
+      reward_scale_factor * rewards + gamma * discounts * next_q_values)
+
+
+def _index_time_axis(tensor, index):
+  """Returns `tensor[:, index]`, also supporting `SparseTensor`s."""
+  if isinstance(tensor, tf.SparseTensor):
+    tensor = composite.slice_from(tensor, axis=1, start=index)
+    tensor = composite.slice_to(tensor, axis=1, end=1)
+    return composite.squeeze(tensor, 1)
+  return tensor[:, index]
+
+
+def _index_with_actions(q_values, actions, multi_dim_actions=False):
+  """Like `common.index_with_actions`, specialized for single dim actions.
+
+  For single dim actions, which is the common case, `q_values` can be indexed
+  with a single batched `tf.gather` instead of building the full index tensor
+  for a `tf.gather_nd`.
+
+  Args:
+    q_values: A float tensor of shape [outer_dim1, ... outer_dimK, num_actions].
+    actions: An int tensor of shape [outer_dim1, ... outer_dimK], or with an
+      additional trailing action dimension if `multi_dim_actions=True`.
+    multi_dim_actions: whether the actions are multidimensional.
+
+  Returns:
+    A [outer_dim1, ... outer_dimK] tensor of q_values for the given actions.
+  """
+  if multi_dim_actions or actions.shape.rank is None:
+    return common.index_with_actions(
+        q_values, actions, multi_dim_actions=multi_dim_actions)
+  # Older versions of `tf.gather` require `batch_dims` to be smaller than the
+  # rank of the indices, so gather along a trailing unit dimension.
+  actions = tf.expand_dims(tf.cast(actions, dtype=tf.int32), -1)
+  q_values = tf.gather(q_values, actions, batch_dims=actions.shape.rank - 1)
+  return tf.squeeze(q_values, -1)
+
+
+def _upcast_reduced_precision(q_values):
+  """Casts float16 or bfloat16 `q_values` up to float32.
+
+  The network may compute in reduced precision (e.g. under a mixed precision
+  policy), but the TD targets and loss are computed in at least float32. Other
+  dtypes, like float64, are passed through unchanged.
+  """
+  if q_values.dtype in (tf.float16, tf.bfloat16):
+    return tf.cast(q_values, tf.float32)
+  return q_values
+
+
+def _masked_td_loss(td_targets, q_values, valid_mask, td_errors_loss_fn):
+  """Computes the masked element wise TD loss and TD error.
+
+  Args:
+    td_targets: A float tensor of TD targets.
+    q_values: A float tensor of Q values, shaped like `td_targets`.
+    valid_mask: A bool tensor shaped like `td_targets`, `False` at episode
+      boundaries.
+    td_errors_loss_fn: A function(td_targets, predictions) to compute the
+      element wise loss.
+
+  Returns:
+    A tuple `(td_loss, td_error)`.
+  """
+  # Note: masking with `tf.where` only zeroes the forward values. A non-finite
+  # value at an episode boundary still turns into NaN gradients (`0 * NaN`)
+  # through `td_errors_loss_fn`, while the loss itself looks finite.
+  td_error = td_targets - q_values
+  td_error = tf.compat.v2.where(valid_mask, td_error, tf.zeros_like(td_error))
+  # The loss function may compute in a different dtype than the Q-values (e.g.
+  # the `tf.compat.v1.losses` based ones always return float32).
+  td_loss = td_errors_loss_fn(td_targets, q_values)
+  td_loss = tf.compat.v2.where(valid_mask, td_loss, tf.zeros_like(td_loss))
+  return td_loss, td_error
 
 
 @gin.configurable
@@ -105,7 +195,9 @@ class DqnAgent(tf_agent.TFAgent):
       gamma=1.0,
       reward_scale_factor=1.0,
       gradient_clipping=None,
+      jit_compile=False,
       # Params for debugging
+      check_numerics=False,
       debug_summaries=False,
       summarize_grads_and_vars=False,
       train_step_counter=None,
@@ -118,7 +210,11 @@ class DqnAgent(tf_agent.TFAgent):
       q_network: A `tf_agents.network.Network` to be used by the agent. The
         network will be called with `call(observation, step_type)` and should
         emit logits over the action space.
-      optimizer: The optimizer to use for training.
+      optimizer: The optimizer to use for training. When training a `q_network`
+        with a mixed precision policy (e.g. `mixed_float16`), wrap the
+        optimizer in a Keras `LossScaleOptimizer`; the loss is then scaled
+        before computing gradients, and the gradients unscaled before they are
+        applied.
       observation_and_action_constraint_splitter: A function used to process
         observations with action constraints. These constraints can indicate,
         for example, a mask of valid/invalid actions for a given state of the
@@ -188,6 +284,15 @@ class DqnAgent(tf_agent.TFAgent):
       gamma: A discount factor for future rewards.
       reward_scale_factor: Multiplicative scale for the reward.
       gradient_clipping: Norm length to clip gradients.
+      jit_compile: If True, the train step is compiled with XLA (via
+        `tf.function(experimental_compile=True)`, requires TF >= 2.1). This
+        fuses the elementwise TD target and loss computations with the
+        network ops, but every op in the train step (including the networks,
+        `td_errors_loss_fn` and any summaries being recorded) must be
+        supported by XLA. Not supported when creating the agent under a
+        distribution strategy.
+      check_numerics: If true, adds `tf.debugging.check_numerics` to help find
+        NaN / Inf values in the loss. For debugging only.
       debug_summaries: A bool to gather debug summaries.
       summarize_grads_and_vars: If True, gradient and network variable summaries
         will be written during training.
@@ -199,6 +304,8 @@ class DqnAgent(tf_agent.TFAgent):
     Raises:
       ValueError: If the action spec contains more than one action or action
         spec minimum is not equal to 0.
+      ValueError: If `jit_compile` is True and the agent is created under a
+        distribution strategy.
       NotImplementedError: If `q_network` has non-empty `state_spec` (i.e., an
         RNN is provided) and `n_step_update > 1`.
     """
@@ -230,6 +337,8 @@ class DqnAgent(tf_agent.TFAgent):
     self._gamma = gamma
     self._reward_scale_factor = reward_scale_factor
     self._gradient_clipping = gradient_clipping
+    self._jit_compile = jit_compile
+    self._check_numerics = check_numerics
     self._update_target = self._get_target_updater(
         target_update_tau, target_update_period)
 
@@ -245,6 +354,27 @@ class DqnAgent(tf_agent.TFAgent):
     train_sequence_length = (
         n_step_update + 1 if not q_network.state_spec else None)
 
+    if tf.distribute.has_strategy():
+      # A nested `tf.function` can't contain the cross-replica gradient
+      # aggregation, so under a distribution strategy it is up to the caller
+      # to trace the call to `strategy.experimental_run_v2(agent.train, ...)`.
+      if jit_compile:
+        raise ValueError(
+            '`jit_compile` is not supported when creating the agent under a '
+            'distribution strategy. Compile the function which calls '
+            '`strategy.experimental_run_v2` instead.')
+    else:
+      # Trace the full train step (forward pass, gradient tape,
+      # `apply_gradients` and target update) into a single graph to avoid
+      # per-op Python dispatch.
+      train_fn_kwargs = {'experimental_compile': True} if jit_compile else {}
+      self._train = common.function(self._train, **train_fn_kwargs)
+    if jit_compile:
+      # Also compile the elementwise TD loss block on its own, so that calls
+      # to `_loss` outside of the train step are fused as well.
+      self._compiled_masked_td_loss = common.function(
+          _masked_td_loss, experimental_compile=True)
+
     super(DqnAgent, self).__init__(
         time_step_spec,
         action_spec,
@@ -272,6 +402,11 @@ class DqnAgent(tf_agent.TFAgent):
           'Action specs should have minimum of 0, but saw: {0}'.format(
               [spec.minimum for spec in flat_action_spec]))
 
+    # Handle action_spec.shape=(), and shape=(1,) by using the multi_dim_actions
+    # param of `common.index_with_actions`. Computed once here rather than on
+    # every train step.
+    self._multi_dim_actions = flat_action_spec[0].shape.rank > 0
+
   def _setup_policy(self, time_step_spec, action_spec,
                     boltzmann_temperature, emit_log_probability):
 
@@ -291,15 +426,6 @@ class DqnAgent(tf_agent.TFAgent):
           policy, epsilon=self._epsilon_greedy)
     policy = greedy_policy.GreedyPolicy(policy)
 
-    # Create self._target_greedy_policy in order to compute target Q-values.
-    target_policy = q_policy.QPolicy(
-        time_step_spec,
-        action_spec,
-        q_network=self._target_q_network,
-        observation_and_action_constraint_splitter=(
-            self._observation_and_action_constraint_splitter))
-    self._target_greedy_policy = greedy_policy.GreedyPolicy(target_policy)
-
     return policy, collect_policy
 
   def _initialize(self):
@@ -322,18 +448,47 @@ class DqnAgent(tf_agent.TFAgent):
     """
     with tf.name_scope('update_targets'):
 
-      def update():
+      def soft_update():
         return common.soft_variables_update(
             self._q_network.variables,
             self._target_q_network.variables,
             tau,
             tau_non_trainable=1.0)
 
+      if tf.executing_eagerly() and not tf.distribute.has_strategy():
+        # Trace all the per-variable assignments into a single function, which
+        # XLA can fuse when `jit_compile` is set. Under a distribution strategy
+        # the update runs inside a cross-replica `merge_call`, where it can't
+        # be traced on its own.
+        update_fn_kwargs = (
+            {'experimental_compile': True} if self._jit_compile else {})
+
+        @common.function(**update_fn_kwargs)
+        def traced_soft_update():
+          # Traced functions can't return an `Operation`.
+          soft_update()
+
+        def update():
+          # `Periodically` wraps the body in a `tf.cond` against `tf.no_op`, so
+          # the body must return an op as well.
+          traced_soft_update()
+          return tf.no_op()
+      else:
+        update = soft_update
+
       return common.Periodically(update, period, 'periodic_update_targets')
 
-  # Use @common.function in graph mode or for speeding up.
   def _train(self, experience, weights):
-    with tf.GradientTape() as tape:
+    # Read on every call rather than cached at construction, so that layers
+    # frozen after the agent is created (`layer.trainable = False`) are not
+    # trained. When `_train` is traced this only runs while tracing, so a layer
+    # frozen after the first train step only takes effect on a retrace.
+    variables_to_train = self._q_network.trainable_weights
+    assert list(variables_to_train), "No variables in the agent's q_network."
+    # Only watch the variables being trained, so that the target network's
+    # forward pass is not recorded on the tape.
+    with tf.GradientTape(watch_accessed_variables=False) as tape:
+      tape.watch(variables_to_train)
       loss_info = self._loss(
           experience,
           td_errors_loss_fn=self._td_errors_loss_fn,
@@ -341,18 +496,28 @@ class DqnAgent(tf_agent.TFAgent):
           reward_scale_factor=self._reward_scale_factor,
           weights=weights,
           training=True)
-    tf.debugging.check_numerics(loss_info.loss, 'Loss is inf or nan')
-    variables_to_train = self._q_network.trainable_weights
-    non_trainable_weights = self._q_network.non_trainable_weights
-    assert list(variables_to_train), "No variables in the agent's q_network."
-    grads = tape.gradient(loss_info.loss, variables_to_train)
-    # Tuple is used for py3, where zip is a generator producing values once.
+      loss = loss_info.loss
+      # Keras `LossScaleOptimizer`s require the loss to be scaled up before
+      # computing gradients, to avoid float16 gradients underflowing.
+      use_loss_scaling = hasattr(self._optimizer, 'get_scaled_loss')
+      if use_loss_scaling:
+        loss = self._optimizer.get_scaled_loss(loss)
+    if self._check_numerics:
+      tf.debugging.check_numerics(loss_info.loss, 'Loss is inf or nan')
+    grads = tape.gradient(loss, variables_to_train)
+    if use_loss_scaling:
+      grads = self._optimizer.get_unscaled_gradients(grads)
+    # A list is used for py3, where zip is a generator producing values once.
+    # Building it is Python-only work, which happens once per trace of `_train`.
     grads_and_vars = list(zip(grads, variables_to_train))
     if self._gradient_clipping is not None:
+      # Each gradient is clipped by its own norm, as in the other agents; this
+      # is not the same as clipping by the global norm of all the gradients.
       grads_and_vars = eager_utils.clip_gradient_norms(grads_and_vars,
                                                        self._gradient_clipping)
 
     if self._summarize_grads_and_vars:
+      non_trainable_weights = self._q_network.non_trainable_weights
       grads_and_vars_with_non_trainable = (
           grads_and_vars + [(None, v) for v in non_trainable_weights])
       eager_utils.add_variables_summaries(grads_and_vars_with_non_trainable,
@@ -366,6 +531,7 @@ class DqnAgent(tf_agent.TFAgent):
 
     return loss_info
 
+  @common.function
   def _loss(self,
             experience,
             td_errors_loss_fn=common.element_wise_huber_loss,
@@ -400,24 +566,9 @@ class DqnAgent(tf_agent.TFAgent):
     # method requires a time dimension to compute the loss properly.
     self._check_trajectory_dimensions(experience)
 
-    squeeze_time_dim = not self._q_network.state_spec
-    if self._n_step_update == 1:
-      time_steps, policy_steps, next_time_steps = (
-          trajectory.experience_to_transitions(experience, squeeze_time_dim))
-      actions = policy_steps.action
-    else:
-      # To compute n-step returns, we need the first time steps, the first
-      # actions, and the last time steps. Therefore we extract the first and
-      # last transitions from our Trajectory.
-      first_two_steps = tf.nest.map_structure(lambda x: x[:, :2], experience)
-      last_two_steps = tf.nest.map_structure(lambda x: x[:, -2:], experience)
-      time_steps, policy_steps, _ = (
-          trajectory.experience_to_transitions(
-              first_two_steps, squeeze_time_dim))
-      actions = policy_steps.action
-      _, _, next_time_steps = (
-          trajectory.experience_to_transitions(
-              last_two_steps, squeeze_time_dim))
+    time_steps, policy_steps, next_time_steps = (
+        self._experience_to_transitions(experience))
+    actions = policy_steps.action
 
     with tf.name_scope('loss'):
       q_values = self._compute_q_values(time_steps, actions, training=training)
@@ -425,12 +576,16 @@ class DqnAgent(tf_agent.TFAgent):
       next_q_values = self._compute_next_q_values(
           next_time_steps, policy_steps.info)
 
+      # `n_step_update` is fixed when the agent is created, so this branch is
+      # resolved once when `_loss` is traced and never causes a retrace.
       if self._n_step_update == 1:
         # Special case for n = 1 to avoid a loss of performance.
         td_targets = compute_td_targets(
             next_q_values,
-            rewards=reward_scale_factor * next_time_steps.reward,
-            discounts=gamma * next_time_steps.discount)
+            rewards=next_time_steps.reward,
+            discounts=next_time_steps.discount,
+            gamma=gamma,
+            reward_scale_factor=reward_scale_factor)
       else:
         # When computing discounted return, we need to throw out the last time
         # index of both reward and discount, which are filled with dummy values
@@ -448,14 +603,20 @@ class DqnAgent(tf_agent.TFAgent):
             time_major=False,
             provide_all_returns=False)
 
-      valid_mask = tf.cast(~time_steps.is_last(), tf.float32)
-      td_error = valid_mask * (td_targets - q_values)
-
-      td_loss = valid_mask * td_errors_loss_fn(td_targets, q_values)
+      # Transitions starting at the last step of an episode cross an episode
+      # boundary, so they are masked out. This can't be derived from the
+      # discount: a zero discount marks a terminal transition, which is valid.
+      valid_mask = tf.not_equal(time_steps.step_type, ts.StepType.LAST)
+      if self._jit_compile:
+        masked_td_loss_fn = self._compiled_masked_td_loss
+      else:
+        masked_td_loss_fn = _masked_td_loss
+      td_loss, td_error = masked_td_loss_fn(
+          td_targets, q_values, valid_mask, td_errors_loss_fn)
 
-      if nest_utils.is_batched_nested_tensors(
-          time_steps, self.time_step_spec, num_outer_dims=2):
-        # Do a sum over the time dimension.
+      if self._q_network.state_spec:
+        # Only stateful networks keep the time dimension of the transitions
+        # (see `_experience_to_transitions`), so do a sum over it.
         td_loss = tf.reduce_sum(input_tensor=td_loss, axis=1)
 
       # Aggregate across the elements of the batch and add regularization loss.
@@ -504,6 +665,52 @@ class DqnAgent(tf_agent.TFAgent):
       return tf_agent.LossInfo(total_loss, DqnLossInfo(td_loss=td_loss,
                                                        td_error=td_error))
 
+  def _experience_to_transitions(self, experience):
+    """Extracts the transitions to train on from `experience`.
+
+    Args:
+      experience: A batch of experience data in the form of a `Trajectory`,
+        shaped `[batch, time, ...]`.
+
+    Returns:
+      A tuple `(time_steps, policy_steps, next_time_steps)`. If `q_network` is
+      stateful these keep the time dimension. Otherwise they are the time steps
+      and actions of the first transition, and the next time steps of the last
+      transition (the only transition for single step updates).
+    """
+    if self._q_network.state_spec:
+      return trajectory.experience_to_transitions(
+          experience, squeeze_time_dim=False)
+
+    # To compute n-step returns, we need the first time steps, the first
+    # actions, and the last time steps. Read them directly off `experience`
+    # rather than slicing out full transitions and squeezing their time
+    # dimension. For single step updates these are the `[:, 0]` and `[:, 1]`
+    # steps.
+    def first(t):
+      return _index_time_axis(t, 0)
+
+    # As in `trajectory.to_transition`, the reward and discount of the first
+    # time steps are unknown and filled with zeros.
+    time_steps = ts.TimeStep(
+        step_type=first(experience.step_type),
+        reward=tf.nest.map_structure(
+            lambda r: tf.zeros_like(first(r)), experience.reward),
+        discount=tf.zeros_like(first(experience.discount)),
+        observation=tf.nest.map_structure(first, experience.observation))
+    policy_steps = policy_step.PolicyStep(
+        action=tf.nest.map_structure(first, experience.action),
+        state=(),
+        info=tf.nest.map_structure(first, experience.policy_info))
+    next_time_steps = ts.TimeStep(
+        step_type=_index_time_axis(experience.next_step_type, -2),
+        reward=tf.nest.map_structure(
+            lambda r: _index_time_axis(r, -2), experience.reward),
+        discount=_index_time_axis(experience.discount, -2),
+        observation=tf.nest.map_structure(
+            lambda o: _index_time_axis(o, -1), experience.observation))
+    return time_steps, policy_steps, next_time_steps
+
   def _compute_q_values(self, time_steps, actions, training=False):
     network_observation = time_steps.observation
 
@@ -513,13 +720,11 @@ class DqnAgent(tf_agent.TFAgent):
 
     q_values, _ = self._q_network(network_observation, time_steps.step_type,
                                   training=training)
-    # Handle action_spec.shape=(), and shape=(1,) by using the multi_dim_actions
-    # param. Note: assumes len(tf.nest.flatten(action_spec)) == 1.
-    multi_dim_actions = self._action_spec.shape.rank > 0
-    return common.index_with_actions(
+    q_values = _upcast_reduced_precision(q_values)
+    return _index_with_actions(
         q_values,
         tf.cast(actions, dtype=tf.int32),
-        multi_dim_actions=multi_dim_actions)
+        multi_dim_actions=self._multi_dim_actions)
 
   def _compute_next_q_values(self, next_time_steps, info):
     """Compute the q value of the next state for TD error computation.
@@ -533,28 +738,46 @@ class DqnAgent(tf_agent.TFAgent):
       A tensor of Q values for the given next state.
     """
     network_observation = next_time_steps.observation
+    mask = None
 
     if self._observation_and_action_constraint_splitter is not None:
-      network_observation, _ = self._observation_and_action_constraint_splitter(
-          network_observation)
+      network_observation, mask = (
+          self._observation_and_action_constraint_splitter(
+              network_observation))
 
     next_target_q_values, _ = self._target_q_network(
         network_observation, next_time_steps.step_type)
-    batch_size = (
-        next_target_q_values.shape[0] or tf.shape(next_target_q_values)[0])
-    dummy_state = self._target_greedy_policy.get_initial_state(batch_size)
-    # Find the greedy actions using our target greedy policy. This ensures that
-    # action constraints are respected and helps centralize the greedy logic.
-    greedy_actions = self._target_greedy_policy.action(
-        next_time_steps, dummy_state).action
-
-    # Handle action_spec.shape=(), and shape=(1,) by using the multi_dim_actions
-    # param. Note: assumes len(tf.nest.flatten(action_spec)) == 1.
-    multi_dim_actions = tf.nest.flatten(self._action_spec)[0].shape.rank > 0
-    return common.index_with_actions(
+    next_target_q_values = _upcast_reduced_precision(next_target_q_values)
+    # Pick the greedy actions from the target Q-values we already have, rather
+    # than running the target network a second time through a greedy policy.
+    greedy_actions = self._greedy_actions(next_target_q_values, mask)
+
+    # `greedy_actions` never has an action dimension, even when
+    # action_spec.shape=(1,).
+    return _index_with_actions(
         next_target_q_values,
         greedy_actions,
-        multi_dim_actions=multi_dim_actions)
+        multi_dim_actions=False)
+
+  def _greedy_actions(self, q_values, mask=None):
+    """Returns the actions with the highest Q-values.
+
+    This matches the actions chosen by a `GreedyPolicy` wrapping a `QPolicy`,
+    but operates directly on Q-values which have already been computed.
+
+    Args:
+      q_values: A float tensor of shape `[outer_dims..., num_actions]`.
+      mask: (Optional.) An action constraint, as returned by
+        `observation_and_action_constraint_splitter`, shaped like `q_values`.
+        Actions for which the mask is 0 are never chosen.
+
+    Returns:
+      An int32 tensor of shape `[outer_dims...]`.
+    """
+    if mask is not None:
+      neg_inf = tf.constant(-np.inf, dtype=q_values.dtype)
+      q_values = tf.compat.v2.where(tf.cast(mask, tf.bool), q_values, neg_inf)
+    return tf.argmax(q_values, axis=-1, output_type=tf.int32)
 
 
 @gin.configurable
@@ -583,24 +806,29 @@ class DdqnAgent(DqnAgent):
     del info
     # TODO(b/117175589): Add binary tests for DDQN.
     network_observation = next_time_steps.observation
+    mask = None
 
     if self._observation_and_action_constraint_splitter is not None:
-      network_observation, _ = self._observation_and_action_constraint_splitter(
-          network_observation)
-
+      network_observation, mask = (
+          self._observation_and_action_constraint_splitter(
+              network_observation))
+
+    # Both networks only depend on the observation, so they are called before
+    # any op that depends on their outputs; inside the traced `_loss` they are
+    # independent and may run concurrently. The online network pass is not
+    # batched with the one in `_compute_q_values`: that one runs with
+    # `training=True`, which changes the output of layers such as dropout or
+    # batch norm, and stateful networks can't be concatenated along the batch.
     next_target_q_values, _ = self._target_q_network(
         network_observation, next_time_steps.step_type)
-    batch_size = (
-        next_target_q_values.shape[0] or tf.shape(next_target_q_values)[0])
-    dummy_state = self._policy.get_initial_state(batch_size)
-    # Find the greedy actions using our greedy policy. This ensures that action
-    # constraints are respected and helps centralize the greedy logic.
-    best_next_actions = self._policy.action(next_time_steps, dummy_state).action
+    next_q_values, _ = self._q_network(
+        network_observation, next_time_steps.step_type)
+    next_target_q_values = _upcast_reduced_precision(next_target_q_values)
+    # Double Q-learning: the greedy actions come from the online network, and
+    # are evaluated using the target network.
+    best_next_actions = self._greedy_actions(next_q_values, mask)
 
-    # Handle action_spec.shape=(), and shape=(1,) by using the multi_dim_actions
-    # param. Note: assumes len(tf.nest.flatten(action_spec)) == 1.
-    multi_dim_actions = tf.nest.flatten(self._action_spec)[0].shape.rank > 0
-    return common.index_with_actions(
+    return _index_with_actions(
         next_target_q_values,
         best_next_actions,
-        multi_dim_actions=multi_dim_actions)
+        multi_dim_actions=False)
@@ -20,6 +20,7 @@ from __future__ import division
 from __future__ import print_function
 
 from absl.testing import parameterized
+import numpy as np
 import tensorflow as tf  # pylint: disable=g-explicit-tensorflow-version-import
 
 from tf_agents.agents.dqn import dqn_agent
@@ -41,10 +42,14 @@ class DummyNet(network.Network):
                observation_spec,
                action_spec,
                l2_regularization_weight=0.0,
+               dtype=None,
                name=None):
     super(DummyNet, self).__init__(
         observation_spec, state_spec=(), name=name)
     num_actions = action_spec.maximum - action_spec.minimum + 1
+    # Only pass an explicit layer dtype when given, as it would override any
+    # global mixed precision policy.
+    layer_kwargs = {'dtype': dtype} if dtype is not None else {}
 
     # Store custom layers that can be serialized through the Checkpointable API.
     self._dummy_layers = [
@@ -54,12 +59,14 @@ class DummyNet(network.Network):
                 l2_regularization_weight),
             kernel_initializer=tf.compat.v1.initializers.constant([[2, 1],
                                                                    [1, 1]]),
-            bias_initializer=tf.compat.v1.initializers.constant([[1], [1]]))
+            bias_initializer=tf.compat.v1.initializers.constant([[1], [1]]),
+            **layer_kwargs)
     ]
+    self._input_dtype = dtype or tf.float32
 
   def call(self, inputs, step_type=None, network_state=()):
     del step_type
-    inputs = tf.cast(inputs, tf.float32)
+    inputs = tf.cast(inputs, self._input_dtype)
     for layer in self._dummy_layers:
       inputs = layer(inputs)
     return inputs, network_state
@@ -76,6 +83,17 @@ class ComputeTDTargetsTest(test_utils.TestCase):
     td_targets = dqn_agent.compute_td_targets(next_q_values, rewards, discounts)
     self.assertAllClose(self.evaluate(td_targets), expected_td_targets)
 
+  def testComputeTDTargetsWithGammaAndRewardScale(self):
+    next_q_values = tf.constant([10, 20], dtype=tf.float32)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+
+    # td_targets = 2 * rewards + 0.5 * discounts * next_q_values
+    expected_td_targets = [24.5, 49.]
+    td_targets = dqn_agent.compute_td_targets(
+        next_q_values, rewards, discounts, gamma=0.5, reward_scale_factor=2.0)
+    self.assertAllClose(self.evaluate(td_targets), expected_td_targets)
+
 
 @parameterized.named_parameters(
     ('DqnAgent', dqn_agent.DqnAgent),
@@ -188,6 +206,116 @@ class DqnAgentTest(test_utils.TestCase):
     self.evaluate(tf.compat.v1.global_variables_initializer())
     self.assertAllClose(self.evaluate(loss), expected_loss)
 
+  def testLossWithSingleElementActionShape(self, agent_class):
+    action_spec = tensor_spec.BoundedTensorSpec((1,), tf.int32, 0, 1)
+    q_net = DummyNet(self._observation_spec, action_spec)
+    agent = agent_class(
+        self._time_step_spec,
+        action_spec,
+        q_network=q_net,
+        optimizer=None)
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+
+    actions = tf.constant([[0], [1]], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+    next_time_steps = ts.transition(next_observations, rewards, discounts)
+
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    # Same values as in testLoss, the extra action dimension must not change
+    # which Q-values are picked.
+    expected_loss = 26.0
+    expected_td_error = [20.3, 32.7]
+    loss, extras = agent._loss(experience)
+
+    self.evaluate(tf.compat.v1.global_variables_initializer())
+    self.assertEqual(extras.td_error.shape, [2])
+    self.assertAllClose(self.evaluate(loss), expected_loss)
+    self.assertAllClose(self.evaluate(extras.td_error), expected_td_error)
+
+  def testLossWithFloat64QNetwork(self, agent_class):
+    time_step_spec = ts.TimeStep(
+        step_type=tensor_spec.TensorSpec([], tf.int32),
+        reward=tensor_spec.TensorSpec([], tf.float64),
+        discount=tensor_spec.BoundedTensorSpec([], tf.float64, 0.0, 1.0),
+        observation=self._observation_spec)
+    q_net = DummyNet(self._observation_spec, self._action_spec,
+                     dtype=tf.float64)
+    agent = agent_class(
+        time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=None)
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.TimeStep(
+        step_type=tf.constant([ts.StepType.FIRST] * 2, dtype=tf.int32),
+        reward=tf.zeros([2], dtype=tf.float64),
+        discount=tf.ones([2], dtype=tf.float64),
+        observation=observations)
+
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+
+    rewards = tf.constant([10, 20], dtype=tf.float64)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float64)
+    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+    # `ts.transition` always creates float32 rewards and discounts.
+    next_time_steps = ts.TimeStep(
+        step_type=tf.constant([ts.StepType.MID] * 2, dtype=tf.int32),
+        reward=rewards,
+        discount=discounts,
+        observation=next_observations)
+
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    # Same values as in testLoss, but the Q-values (and so the TD errors) are
+    # not downcast to float32.
+    expected_loss = 26.0
+    expected_td_error = [20.3, 32.7]
+    loss, extras = agent._loss(experience)
+
+    self.evaluate(tf.compat.v1.global_variables_initializer())
+    self.assertEqual(extras.td_error.dtype, tf.float64)
+    self.assertAllClose(self.evaluate(loss), expected_loss)
+    self.assertAllClose(self.evaluate(extras.td_error), expected_td_error)
+
+  def testLossWithJitCompile(self, agent_class):
+    if not tf.executing_eagerly():
+      self.skipTest('experimental_compile requires TF2 behavior.')
+    q_net = DummyNet(self._observation_spec, self._action_spec)
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=None,
+        jit_compile=True)
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+    next_time_steps = ts.transition(next_observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    # See the loss explanation in testLoss above.
+    expected_loss = 26.0
+    loss, _ = agent._loss(
+        experience, td_errors_loss_fn=common.element_wise_huber_loss)
+    self.assertAllClose(self.evaluate(loss), expected_loss)
+
   def testLossWithChangedOptimalActions(self, agent_class):
     q_net = DummyNet(self._observation_spec, self._action_spec)
     agent = agent_class(
@@ -430,6 +558,73 @@ class DqnAgentTest(test_utils.TestCase):
     self.evaluate(tf.compat.v1.global_variables_initializer())
     self.assertAllClose(self.evaluate(loss), expected_loss)
 
+  def testPeriodicSoftTargetUpdate(self, agent_class):
+    q_net = DummyNet(self._observation_spec, self._action_spec)
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=None,
+        target_update_tau=0.5,
+        target_update_period=2)
+    self.evaluate(tf.compat.v1.global_variables_initializer())
+    self.evaluate(agent.initialize())
+    for v in q_net.variables:
+      self.evaluate(v.assign(tf.zeros_like(v)))
+    target_kernel = agent._target_q_network.variables[0]
+
+    # The target network is only moved halfway towards the (zeroed) q network
+    # on every second call.
+    self.evaluate(agent._update_target())
+    self.assertAllClose(self.evaluate(target_kernel), [[2, 1], [1, 1]])
+    self.evaluate(agent._update_target())
+    self.assertAllClose(self.evaluate(target_kernel), [[1, .5], [.5, .5]])
+    self.evaluate(agent._update_target())
+    self.evaluate(agent._update_target())
+    self.assertAllClose(self.evaluate(target_kernel), [[.5, .25], [.25, .25]])
+
+  def testTrainWithPeriodicSoftTargetUpdate(self, agent_class):
+    q_net = DummyNet(self._observation_spec, self._action_spec)
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        # A zero learning rate keeps the (zeroed) q network fixed.
+        optimizer=tf.compat.v1.train.GradientDescentOptimizer(0.0),
+        target_update_tau=0.5,
+        target_update_period=2)
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_time_steps = ts.transition(observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    self.evaluate(tf.compat.v1.global_variables_initializer())
+    self.evaluate(agent.initialize())
+    for v in q_net.variables:
+      self.evaluate(v.assign(tf.zeros_like(v)))
+    target_kernel = agent._target_q_network.variables[0]
+
+    # The target network is only moved halfway towards the q network on every
+    # second train step.
+    if tf.executing_eagerly():
+      train = lambda: agent.train(experience)
+    else:
+      train_op = agent.train(experience)
+      train = lambda: train_op
+    self.evaluate(train())
+    self.assertAllClose(self.evaluate(target_kernel), [[2, 1], [1, 1]])
+    self.evaluate(train())
+    self.assertAllClose(self.evaluate(target_kernel), [[1, .5], [.5, .5]])
+    self.evaluate(train())
+    self.evaluate(train())
+    self.assertAllClose(self.evaluate(target_kernel), [[.5, .25], [.25, .25]])
+
   def testPolicy(self, agent_class):
     q_net = DummyNet(self._observation_spec, self._action_spec)
     agent = agent_class(
@@ -475,6 +670,208 @@ class DqnAgentTest(test_utils.TestCase):
         checkpoint_load_status.initialize_or_restore(sess)
         self.assertAllEqual(sess.run(action_step.action), [0, 0])
 
+  def testTrainWithDifferentBatchSizes(self, agent_class):
+    q_net = DummyNet(self._observation_spec, self._action_spec)
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=tf.compat.v1.train.GradientDescentOptimizer(0.01))
+
+    # The train step is traced, so a new batch size must not recreate any
+    # variables (e.g. optimizer slots) when the function is retraced.
+    for batch_size in [2, 3]:
+      observations = tf.ones([batch_size, 2], dtype=tf.float32)
+      time_steps = ts.restart(observations, batch_size=batch_size)
+      actions = tf.zeros([batch_size], dtype=tf.int32)
+      action_steps = policy_step.PolicyStep(actions)
+      rewards = tf.ones([batch_size], dtype=tf.float32)
+      discounts = tf.ones([batch_size], dtype=tf.float32)
+      next_time_steps = ts.transition(observations, rewards, discounts)
+      experience = trajectories_test_utils.stacked_trajectory_from_transition(
+          time_steps, action_steps, next_time_steps)
+
+      loss_info = agent.train(experience)
+      self.evaluate(tf.compat.v1.global_variables_initializer())
+      self.assertGreater(self.evaluate(loss_info.loss), 0)
+
+  def testTrainWithLayerFrozenAfterCreation(self, agent_class):
+    q_net = q_network.QNetwork(
+        self._observation_spec, self._action_spec, fc_layer_params=(4,))
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=tf.compat.v1.train.GradientDescentOptimizer(0.1))
+    # Freeze the encoder once the agent exists, e.g. to fine-tune the Q-value
+    # layer on top of a fixed encoder.
+    q_net._encoder.trainable = False
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_time_steps = ts.transition(observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    if tf.executing_eagerly():
+      train = lambda: agent.train(experience)
+    else:
+      train_op = agent.train(experience)
+      train = lambda: train_op
+    self.evaluate(tf.compat.v1.global_variables_initializer())
+    encoder_before, q_layer_before = self.evaluate(
+        (q_net._encoder.variables, q_net._q_value_layer.variables))
+    self.evaluate(train())
+    encoder_after, q_layer_after = self.evaluate(
+        (q_net._encoder.variables, q_net._q_value_layer.variables))
+
+    self.assertAllClose(encoder_before, encoder_after)
+    self.assertNotAllClose(q_layer_before[0], q_layer_after[0])
+
+  def testTrainWithCheckNumerics(self, agent_class):
+    if not tf.executing_eagerly():
+      self.skipTest('Only runs in eager mode.')
+    q_net = DummyNet(self._observation_spec, self._action_spec)
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=tf.compat.v1.train.GradientDescentOptimizer(0.01),
+        check_numerics=True)
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, np.nan], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_time_steps = ts.transition(observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    with self.assertRaisesRegexp(tf.errors.InvalidArgumentError,
+                                 'Loss is inf or nan'):
+      agent.train(experience)
+
+  def testTrainWithJitCompile(self, agent_class):
+    if not tf.executing_eagerly():
+      self.skipTest('experimental_compile requires TF2 behavior.')
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+    next_time_steps = ts.transition(next_observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    losses = []
+    for jit_compile in [False, True]:
+      q_net = DummyNet(self._observation_spec, self._action_spec)
+      agent = agent_class(
+          self._time_step_spec,
+          self._action_spec,
+          q_network=q_net,
+          optimizer=tf.compat.v1.train.GradientDescentOptimizer(0.01),
+          jit_compile=jit_compile)
+      losses.append(agent.train(experience).loss)
+
+    # See the loss explanation in testLoss above.
+    self.assertAllClose(losses[0], 26.0)
+    self.assertAllClose(losses[1], losses[0])
+
+  def testTrainWithMixedPrecision(self, agent_class):
+    if not tf.executing_eagerly():
+      self.skipTest('Keras mixed precision policies require TF2 behavior.')
+    mixed_precision = tf.keras.mixed_precision.experimental
+    mixed_precision.set_policy('mixed_float16')
+    self.addCleanup(mixed_precision.set_policy, 'float32')
+
+    q_net = DummyNet(self._observation_spec, self._action_spec)
+    optimizer = mixed_precision.LossScaleOptimizer(
+        tf.keras.optimizers.SGD(0.01), loss_scale='dynamic')
+    agent = agent_class(
+        self._time_step_spec,
+        self._action_spec,
+        q_network=q_net,
+        optimizer=optimizer)
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+    next_time_steps = ts.transition(next_observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+
+    # The network itself must compute in float16, otherwise this test would
+    # pass without exercising mixed precision at all.
+    q_values, _ = q_net(observations)
+    self.assertEqual(q_values.dtype, tf.float16)
+
+    loss_info = agent.train(experience)
+    # See the loss explanation in testLoss above.
+    self.assertEqual(loss_info.loss.dtype, tf.float32)
+    self.assertAllClose(self.evaluate(loss_info.loss), 26.0, rtol=1e-2)
+
+  def testTrainWithMirroredStrategy(self, agent_class):
+    if not tf.executing_eagerly():
+      self.skipTest('experimental_run_v2 requires TF2 behavior.')
+    strategy = tf.distribute.MirroredStrategy(['/cpu:0'])
+    with strategy.scope():
+      q_net = DummyNet(self._observation_spec, self._action_spec)
+      agent = agent_class(
+          self._time_step_spec,
+          self._action_spec,
+          q_network=q_net,
+          optimizer=tf.keras.optimizers.SGD(0.01),
+          target_update_tau=0.5)
+      agent.initialize()
+
+    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+    time_steps = ts.restart(observations, batch_size=2)
+    actions = tf.constant([0, 1], dtype=tf.int32)
+    action_steps = policy_step.PolicyStep(actions)
+    rewards = tf.constant([10, 20], dtype=tf.float32)
+    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
+    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+    next_time_steps = ts.transition(next_observations, rewards, discounts)
+    experience = trajectories_test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+    dataset = tf.data.Dataset.from_tensors(experience).repeat()
+    iterator = iter(strategy.experimental_distribute_dataset(dataset))
+
+    @common.function
+    def train_step():
+      loss_info = strategy.experimental_run_v2(
+          agent.train, args=(next(iterator),))
+      return strategy.reduce(
+          tf.distribute.ReduceOp.SUM, loss_info.loss, axis=None)
+
+    # See the loss explanation in testLoss above.
+    self.assertAllClose(self.evaluate(train_step()), 26.0)
+    self.assertLess(self.evaluate(train_step()), 26.0)
+
+  def testJitCompileUnderStrategyRaises(self, agent_class):
+    with tf.distribute.MirroredStrategy(['/cpu:0']).scope():
+      q_net = DummyNet(self._observation_spec, self._action_spec)
+      with self.assertRaisesRegexp(ValueError, 'jit_compile'):
+        agent_class(
+            self._time_step_spec,
+            self._action_spec,
+            q_network=q_net,
+            optimizer=None,
+            jit_compile=True)
+
   def testTrainWithSparseTensorAndDenseFeaturesLayer(self, agent_class):
     obs_spec = {
         'dense': tensor_spec.BoundedTensorSpec(
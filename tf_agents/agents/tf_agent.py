@@ -181,7 +181,10 @@ class TFAgent(tf.Module):
     # match.
     if self._num_outer_dims == 2 and self.train_sequence_length is not None:
       def check_shape(t):  # pylint: disable=invalid-name
-        if t.shape[1] != self.train_sequence_length:
+        # An unknown time dimension (e.g. a `SparseTensor` traced inside a
+        # `tf.function`) cannot be checked statically, so it is skipped.
+        time_dim = tf.compat.dimension_value(t.shape[1])
+        if time_dim is not None and time_dim != self.train_sequence_length:
           debug_str = tf.nest.map_structure(lambda tp: tp.shape, experience)
           raise ValueError(
               "One of the Tensors in `experience` has a time axis dim value "
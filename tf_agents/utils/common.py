@@ -1207,11 +1207,15 @@ def check_matching_networks(network_1, network_2):
                      'do not match: {} vs. {}.'.format(
                          network_1.input_tensor_spec,
                          network_2.input_tensor_spec))
-  if len(network_1.variables) != len(network_2.variables):
+  # `Network.variables` walks all the layers, so only collect the variables
+  # once per network.
+  variables_1 = network_1.variables
+  variables_2 = network_2.variables
+  if len(variables_1) != len(variables_2):
     raise ValueError(
         'Variables lengths do not match between Q network and target network: '
-        '{} vs. {}'.format(network_1.variables, network_2.variables))
-  for v1, v2 in zip(network_1.variables, network_2.variables):
+        '{} vs. {}'.format(variables_1, variables_2))
+  for v1, v2 in zip(variables_1, variables_2):
     if v1.dtype != v2.dtype or v1.shape != v2.shape:
       raise ValueError(
           'Variable dtypes or shapes do not match: {} vs. {}'.format(v1, v2))